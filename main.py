@@ -1,23 +1,60 @@
 from fastapi import FastAPI, Form, Query, HTTPException, Request, Response, Depends
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Optional, Any
+from typing import Dict, Optional, Tuple
 import os
+import re
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+import gzip
+import hashlib
+import hmac
 import time
-import uuid
+import itertools
 import random
 import asyncio
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import NoScriptError, RedisError
+except ImportError:  # Redis is optional, the limiter falls back to in-process state
+    aioredis = None
 from utils.downloader import (
     download_with_retry, 
     get_video_formats, 
     get_best_available_format,
     check_dependencies,
-    normalize_youtube_url
+    normalize_youtube_url,
+    clear_formats_cache,
+    is_preset_format,
+    prune_video_cache
 )
 
-app = FastAPI(title="YouTube Video Downloader API")
+def setup_logging() -> logging.handlers.QueueListener:
+    """Log through a queue so request handlers never block on stderr writes"""
+    log_queue: queue.Queue = queue.Queue(-1)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+
+    root_logger = logging.getLogger()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="YouTube Video Downloader API", default_response_class=ORJSONResponse)
 
 # CORS middleware to allow requests from browsers
 app.add_middleware(
@@ -32,83 +69,179 @@ app.add_middleware(
 DOWNLOAD_DIR = os.path.join(os.getcwd(), "downloads")
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
+# When running behind nginx, set X_ACCEL_REDIRECT_PREFIX (e.g. "/internal/") to an
+# internal location aliased to DOWNLOAD_DIR so nginx streams the files instead of Python
+X_ACCEL_REDIRECT_PREFIX = os.environ.get("X_ACCEL_REDIRECT_PREFIX", "").strip()
+
 # Mount static files directory if it exists
 STATIC_DIR = os.path.join(os.getcwd(), "static")
 if os.path.exists(STATIC_DIR):
     app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 # Simple rate limiting
+# Set REDIS_URL to share the limiter across workers/replicas; without it we
+# fall back to the per-process dict below.
+REDIS_URL = os.environ.get("REDIS_URL", "").strip()
+redis_client = None
+rate_limit_sha: Optional[str] = None
 rate_limit_store = {}
 RATE_LIMIT = 5  # requests
 RATE_WINDOW = 60  # seconds
 
-# Track suspicious activity
-suspicious_ips = {}
+# Token bucket: RATE_LIMIT tokens, one refilled every RATE_WINDOW / RATE_LIMIT seconds.
+# Runs atomically inside Redis and returns 0 when allowed, otherwise the time (ms)
+# at which the next token becomes available.
+RATE_LIMIT_LUA = """
+local key = KEYS[1]
+local max_tokens = tonumber(ARGV[1])
+local refill_interval = tonumber(ARGV[2])
+local refill_rate = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or max_tokens
+local ts = tonumber(bucket[2]) or now
+local refills = math.floor((now - ts) / refill_interval)
+if refills > 0 then
+    tokens = math.min(max_tokens, tokens + refills * refill_rate)
+    ts = ts + refills * refill_interval
+end
+if tokens < 1 then
+    return ts + refill_interval
+end
+redis.call('HSET', key, 'tokens', tokens - 1, 'ts', ts)
+redis.call('PEXPIRE', key, refill_interval * math.ceil(max_tokens / refill_rate))
+return 0
+"""
+RATE_REFILL_MS = RATE_WINDOW * 1000 // RATE_LIMIT
 
-def check_rate_limit(client_ip: str) -> bool:
-    """Check if the client has exceeded rate limits"""
+# IPs known to be limited -> time (s) their next token arrives. Lets us reject
+# floods locally without a Redis round trip.
+rate_limited_until: Dict[str, float] = {}
+RATE_LIMITED_CACHE_SIZE = 100_000
+
+# Track suspicious activity (bounded, least recently flagged IPs are dropped first)
+suspicious_ips: Dict[str, int] = {}
+SUSPICIOUS_IPS_MAX = 10_000
+RATE_LIMIT_STORE_MAX = 100_000
+
+def _mark_suspicious(client_ip: str) -> None:
+    """Count a rate limit hit against the client"""
+    # Re-insert so the dict stays ordered from least to most recently flagged
+    suspicious_ips[client_ip] = suspicious_ips.pop(client_ip, 0) + 1
+    if len(suspicious_ips) > SUSPICIOUS_IPS_MAX:
+        del suspicious_ips[next(iter(suspicious_ips))]
+
+def _check_rate_limit_local(client_ip: str) -> bool:
+    """In-process fixed window limiter used when Redis is not configured"""
     current_time = time.time()
     
-    # Cleanup old entries
-    for ip in list(rate_limit_store.keys()):
-        if current_time - rate_limit_store[ip]["timestamp"] > RATE_WINDOW:
-            del rate_limit_store[ip]
+    # Cleanup old entries; windows are never extended, so the dict is in
+    # timestamp order and expired entries are all at the front
+    while rate_limit_store:
+        oldest_ip = next(iter(rate_limit_store))
+        if current_time - rate_limit_store[oldest_ip]["timestamp"] <= RATE_WINDOW:
+            break
+        del rate_limit_store[oldest_ip]
     
     # Check current IP
     if client_ip in rate_limit_store:
         entry = rate_limit_store[client_ip]
-        if current_time - entry["timestamp"] <= RATE_WINDOW:
-            if entry["count"] >= RATE_LIMIT:
-                # Mark as suspicious if hitting rate limit frequently
-                if client_ip not in suspicious_ips:
-                    suspicious_ips[client_ip] = 0
-                suspicious_ips[client_ip] += 1
-                return False
-            entry["count"] += 1
-            return True
-    else:
-        rate_limit_store[client_ip] = {"count": 1, "timestamp": current_time}
+        if entry["count"] >= RATE_LIMIT:
+            # Mark as suspicious if hitting rate limit frequently
+            _mark_suspicious(client_ip)
+            return False
+        entry["count"] += 1
         return True
+    if len(rate_limit_store) >= RATE_LIMIT_STORE_MAX:
+        del rate_limit_store[next(iter(rate_limit_store))]
+    rate_limit_store[client_ip] = {"count": 1, "timestamp": current_time}
+    return True
+
+def _remember_rate_limited(client_ip: str, until: float) -> None:
+    """Cache that the client is limited until the given time"""
+    if len(rate_limited_until) >= RATE_LIMITED_CACHE_SIZE:
+        now = time.time()
+        for ip in [ip for ip, ts in rate_limited_until.items() if ts <= now]:
+            del rate_limited_until[ip]
+        while len(rate_limited_until) >= RATE_LIMITED_CACHE_SIZE:
+            del rate_limited_until[next(iter(rate_limited_until))]
+    rate_limited_until[client_ip] = until
+
+async def check_rate_limit(client_ip: str) -> bool:
+    """Check if the client has exceeded rate limits"""
+    global rate_limit_sha
+    if redis_client is None:
+        return _check_rate_limit_local(client_ip)
+
+    now = time.time()
+    until = rate_limited_until.get(client_ip)
+    if until is not None:
+        if until > now:
+            _mark_suspicious(client_ip)
+            return False
+        del rate_limited_until[client_ip]
 
-def get_client_fingerprint(request: Request) -> str:
-    """Generate a client fingerprint to help identify automated requests"""
-    headers = request.headers
-    ua = headers.get("user-agent", "")
-    accept = headers.get("accept", "")
-    lang = headers.get("accept-language", "")
-    encoding = headers.get("accept-encoding", "")
-    return f"{ua}|{accept}|{lang}|{encoding}"
+    args = [RATE_LIMIT, RATE_REFILL_MS, 1, int(now * 1000)]
+    key = f"ratelimit:{client_ip}"
+    try:
+        try:
+            retry_at_ms = await redis_client.evalsha(rate_limit_sha, 1, key, *args)
+        except NoScriptError:
+            # Script cache was flushed (e.g. Redis restart), load it again
+            rate_limit_sha = await redis_client.script_load(RATE_LIMIT_LUA)
+            retry_at_ms = await redis_client.evalsha(rate_limit_sha, 1, key, *args)
+    except RedisError as e:
+        logger.warning("⚠️ Redis rate limit error, using local limiter: %s", e)
+        return _check_rate_limit_local(client_ip)
+
+    if retry_at_ms:
+        _remember_rate_limited(client_ip, retry_at_ms / 1000)
+        _mark_suspicious(client_ip)
+        return False
+    return True
+
+# Common automation signatures in user agents
+BOT_UA_RE = re.compile(r"python|bot|curl|wget|http-client", re.IGNORECASE)
 
 def is_suspicious_client(request: Request) -> bool:
     """Check if client appears to be using automation"""
     client_ip = request.client.host
     
     # Check if IP has hit rate limits before
-    if client_ip in suspicious_ips and suspicious_ips[client_ip] > 2:
-        return True
-        
-    # Check for missing or unusual headers
-    headers = request.headers
-    ua = headers.get("user-agent", "")
-    if not ua or len(ua) < 20:
+    if suspicious_ips.get(client_ip, 0) > 2:
         return True
         
-    # Check for common bot fingerprints
-    fp = get_client_fingerprint(request)
-    suspicious_patterns = ["python", "bot", "curl", "wget", "http-client"]
-    return any(pattern in fp.lower() for pattern in suspicious_patterns)
+    # Check for missing/short user agents and common bot fingerprints
+    ua = request.headers.get("user-agent", "")
+    return len(ua) < 20 or BOT_UA_RE.search(ua) is not None
+
+async def enforce_rate_limit(request: Request) -> None:
+    """Route dependency for the endpoints that hit YouTube; runs inside CORS so 429s stay readable"""
+    client_ip = request.client.host
+    if not await check_rate_limit(client_ip):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
+
+    # Apply small random delay for suspicious clients on the expensive download endpoint;
+    # repeat offenders are turned away from the format listing outright
+    if request.method == "POST":
+        if is_suspicious_client(request):
+            delay = random.uniform(1.0, 3.0)
+            await asyncio.sleep(delay)
+    elif suspicious_ips.get(client_ip, 0) > 5:
+        raise HTTPException(status_code=429, detail="Too many requests. Please try again later.")
+
+# Request IDs: worker pid + per-process counter, unique across workers without urandom
+PID_HEX = f"{os.getpid():x}"
+request_counter = itertools.count(1)
 
 @app.middleware("http")
 async def add_request_middleware(request: Request, call_next):
     """Add request tracking and anti-bot measures"""
-    request_id = str(uuid.uuid4())
+    request_id = f"{PID_HEX}-{next(request_counter):x}"
     start_time = time.time()
     
-    # Apply small random delay for suspicious clients
-    if is_suspicious_client(request):
-        delay = random.uniform(1.0, 3.0)
-        await asyncio.sleep(delay)
-    
+    path = request.url.path
+
     # Process the request
     response = await call_next(request)
     
@@ -117,16 +250,15 @@ async def add_request_middleware(request: Request, call_next):
     response.headers["X-Process-Time"] = str(process_time)
     response.headers["X-Request-ID"] = request_id
     
-    # Add cache control headers to prevent caching
-    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
+    # Add cache control headers to prevent caching (the static frontend sets its own)
+    if path != "/":
+        response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
+        response.headers["Pragma"] = "no-cache"
+        response.headers["Expires"] = "0"
     
     return response
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    """Simple HTML frontend if no static files are available"""
-    html_content = """
+# Simple HTML frontend if no static files are available, encoded once at import
+ROOT_HTML = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -352,89 +484,200 @@ async def root():
     </body>
     </html>
     """
-    return html_content
+ROOT_HTML_BYTES = ROOT_HTML.encode("utf-8")
+ROOT_HTML_GZIP = gzip.compress(ROOT_HTML_BYTES, 9)
+ROOT_HTML_HASH = hashlib.md5(ROOT_HTML_BYTES).hexdigest()
+ROOT_HTML_ETAG = f'"{ROOT_HTML_HASH}"'
+ROOT_HTML_GZIP_ETAG = f'"{ROOT_HTML_HASH}-gzip"'
+ROOT_CACHE_CONTROL = "public, max-age=3600"
+
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request):
+    """Simple HTML frontend if no static files are available"""
+    use_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag = ROOT_HTML_GZIP_ETAG if use_gzip else ROOT_HTML_ETAG
+    headers = {"ETag": etag, "Cache-Control": ROOT_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(ROOT_HTML_GZIP, media_type="text/html", headers=headers)
+    return Response(ROOT_HTML_BYTES, media_type="text/html", headers=headers)
+
+class VideoFileResponse(FileResponse):
+    """FileResponse with 1 MiB reads to cut syscalls on large video files"""
+    chunk_size = 1024 * 1024
+
+# Downloads in progress keyed by (normalized url, format) so duplicate requests share one
+in_flight_downloads: Dict[Tuple[str, str], asyncio.Task] = {}
+
+def file_download_response(file_path: str, stat_result: Optional[os.stat_result] = None) -> Response:
+    """Send a downloaded file, handing the transfer to nginx when X-Accel-Redirect is enabled"""
+    filename = os.path.basename(file_path)
+    if not X_ACCEL_REDIRECT_PREFIX:
+        return VideoFileResponse(
+            file_path,
+            filename=filename,
+            media_type="application/octet-stream",
+            stat_result=stat_result,
+        )
+
+    quoted = quote(filename)
+    if quoted != filename:
+        content_disposition = f"attachment; filename*=utf-8''{quoted}"
+    else:
+        content_disposition = f'attachment; filename="{filename}"'
+    return Response(
+        status_code=200,
+        headers={
+            "X-Accel-Redirect": f"{X_ACCEL_REDIRECT_PREFIX}{quoted}",
+            "Content-Disposition": content_disposition,
+            "Content-Type": "application/octet-stream",
+        },
+    )
+
+async def download_once(url: str, format_code: str) -> str:
+    """Run download_with_retry, sharing the result with concurrent requests for the same video"""
+    key = (url, format_code)
+    task = in_flight_downloads.get(key)
+    if task is None:
+        # The download runs as its own task, so no single request owns it
+        task = asyncio.ensure_future(asyncio.to_thread(download_with_retry, url, format_code, 3))
+        in_flight_downloads[key] = task
+
+        def _done(t: asyncio.Task) -> None:
+            if in_flight_downloads.get(key) is t:
+                del in_flight_downloads[key]
+            if not t.cancelled():
+                t.exception()  # Mark as retrieved in case every waiter disconnected
 
-@app.post("/download")
+        task.add_done_callback(_done)
+    # Shield so a disconnecting client doesn't cancel the download for everyone else
+    return await asyncio.shield(task)
+
+@app.post("/download", dependencies=[Depends(enforce_rate_limit)])
 async def download_youtube_video(
-    request: Request,
     url: str = Form(...), 
     format_code: str = Form("best")
 ):
     """Download a YouTube video with the specified format"""
-    # Get client IP
-    client_ip = request.client.host
-    
-    # Check rate limit
-    if not check_rate_limit(client_ip):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
-    
     try:
         # Normalize and validate URL
         url = normalize_youtube_url(url)
-        print(f"📥 Received URL: {url}, format: {format_code}")
+        logger.info("📥 Received URL: %s, format: %s", url, format_code)
 
-        # Get available formats
-        try:
-            available_formats = get_video_formats(url)
-            available_ids = [f["format_id"] for f in available_formats]
-            print(f"🎞️ Available format IDs: {available_ids}")
-        except Exception as e:
-            print(f"⚠️ Warning: Could not get formats: {e}")
-            available_ids = ["best"]  # Fallback
+        # "best" and the resolution tiers go straight to yt-dlp's selector; only raw format IDs
+        # need the format list to be validated against
+        if is_preset_format(format_code):
+            available_ids = [format_code]
+        else:
+            # Get available formats
+            try:
+                available_formats = await asyncio.to_thread(get_video_formats, url)
+                available_ids = [f["format_id"] for f in available_formats]
+                logger.info("🎞️ Available format IDs: %s", available_ids)
+            except Exception as e:
+                logger.warning("⚠️ Warning: Could not get formats: %s", e)
+                available_ids = ["best"]  # Fallback
 
         # Validate format_code or find closest match
         if format_code not in available_ids:
             # Try to match resolution if format_code looks like a resolution (e.g., "720")
             if format_code.isdigit():
-                format_code = get_best_available_format(url, int(format_code))
-                print(f"🔄 Using closest available format: {format_code}")
+                format_code = await asyncio.to_thread(get_best_available_format, url, int(format_code))
+                logger.info("🔄 Using closest available format: %s", format_code)
             else:
                 format_code = "best"  # Fallback to best
 
         # Use the retry mechanism with improved audio handling
-        file_path = download_with_retry(url, format_code, max_retries=3)
-        print(f"✅ File path received: {file_path}")
+        file_path = await download_once(url, format_code)
+        logger.info("✅ File path received: %s", file_path)
 
-        if os.path.exists(file_path):
-            return FileResponse(
-                file_path,
-                filename=os.path.basename(file_path),
-                media_type="application/octet-stream"
-            )
-
-        raise HTTPException(status_code=404, detail="File not found")
+        # One stat here, reused by FileResponse for Content-Length and Last-Modified
+        try:
+            stat_result = os.stat(file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found")
+        return file_download_response(file_path, stat_result)
     except Exception as e:
-        print(f"❌ Exception: {str(e)}")
+        logger.error("❌ Exception: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/formats", response_model=List[Dict[str, Any]])
+@app.get("/formats", dependencies=[Depends(enforce_rate_limit)])
 async def list_formats(
-    request: Request,
     url: str = Query(...)
 ):
     """Get available video formats for a YouTube URL"""
-    # Get client IP
-    client_ip = request.client.host
-    
-    # Check rate limit
-    if not check_rate_limit(client_ip):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
-        
     try:
-        return get_video_formats(url)
+        return await asyncio.to_thread(get_video_formats, url)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/check-dependencies")
 async def check_system_dependencies():
     """Check if required dependencies are installed"""
-    return check_dependencies()
+    return await asyncio.to_thread(check_dependencies)
+
+@app.post("/cache/clear")
+async def clear_cache(request: Request):
+    """Drop cached format listings (requires the X-Admin-Token header to match ADMIN_TOKEN)"""
+    admin_token = os.environ.get("ADMIN_TOKEN", "")
+    supplied = request.headers.get("x-admin-token", "")
+    # Constant-time compare so the token can't be guessed byte by byte from response timing
+    if not admin_token or not hmac.compare_digest(supplied.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    # Clearing rewrites the on-disk cache file, so keep it off the event loop
+    return {"cleared": await asyncio.to_thread(clear_formats_cache)}
 
 @app.get("/health")
 async def health_check():
     """Simple health check endpoint"""
     return {"status": "ok", "version": "1.0.0"}
 
+@app.on_event("startup")
+async def setup_executor():
+    """Size the default thread pool used for blocking yt-dlp calls"""
+    max_workers = int(os.environ.get("DOWNLOAD_THREADS", "32"))
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max_workers))
+
+@app.on_event("startup")
+async def setup_rate_limiter():
+    """Connect to Redis and load the rate limit script if REDIS_URL is set"""
+    global redis_client, rate_limit_sha
+    if not REDIS_URL:
+        return
+    if aioredis is None:
+        logger.warning("⚠️ REDIS_URL is set but the redis package is not installed, using local rate limiter")
+        return
+    try:
+        client = aioredis.from_url(REDIS_URL)
+        rate_limit_sha = await client.script_load(RATE_LIMIT_LUA)
+        redis_client = client
+        logger.info("✅ Redis rate limiter enabled")
+    except Exception as e:
+        logger.warning("⚠️ Could not connect to Redis, using local rate limiter: %s", e)
+
+@app.on_event("shutdown")
+async def close_rate_limiter():
+    """Close the Redis connection pool"""
+    if redis_client is not None:
+        await redis_client.aclose()
+
+def remove_old_downloads(max_age: float = 7200) -> int:
+    """Delete files in DOWNLOAD_DIR older than max_age seconds, returning how many were removed"""
+    now = time.time()
+    count = 0
+    # scandir gives us the file type from the directory listing, so only one stat per file
+    with os.scandir(DOWNLOAD_DIR) as entries:
+        for entry in entries:
+            # Dotfiles hold downloader state (e.g. the video cache index), not downloads
+            if entry.name.startswith("."):
+                continue
+            if entry.is_file(follow_symlinks=False) and now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+                count += 1
+    return count
+
 # Cleanup task to remove old downloads
 @app.on_event("startup")
 async def setup_periodic_cleanup():
@@ -443,17 +686,15 @@ async def setup_periodic_cleanup():
         while True:
             try:
                 # Delete files older than 2 hours
-                now = time.time()
-                count = 0
-                for filename in os.listdir(DOWNLOAD_DIR):
-                    file_path = os.path.join(DOWNLOAD_DIR, filename)
-                    if os.path.isfile(file_path) and now - os.path.getmtime(file_path) > 7200:  # 2 hours
-                        os.remove(file_path)
-                        count += 1
+                count = await asyncio.to_thread(remove_old_downloads, 7200)
                 if count > 0:
-                    print(f"🧹 Cleaned up {count} old files")
+                    logger.info("🧹 Cleaned up %d old files", count)
+                # Forget cache entries for those files (and anything past its TTL)
+                pruned = await asyncio.to_thread(prune_video_cache)
+                if pruned > 0:
+                    logger.info("🧹 Pruned %d video cache entries", pruned)
             except Exception as e:
-                print(f"⚠️ Cleanup error: {e}")
+                logger.warning("⚠️ Cleanup error: %s", e)
                 
             # Sleep for 30 minutes
             await asyncio.sleep(1800)
@@ -463,4 +704,19 @@ async def setup_periodic_cleanup():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
+    # One worker unless asked for more. Each worker is its own process, and download
+    # de-duplication and the video cache index are per process: two workers can write the same
+    # file at once and overwrite each other's .cache.json entries. Scale with threads instead.
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        logger.warning("⚠️ Running %d workers: duplicate downloads and the video cache aren't shared between them", workers)
+        if not REDIS_URL:
+            logger.warning("⚠️ Running %d workers without REDIS_URL, rate limits apply per worker", workers)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8000)),
+        workers=workers,
+        loop="auto",  # uvloop when installed (it isn't available on Windows)
+        http="httptools",
+    )
@@ -3,16 +3,29 @@ import re
 import sys
 import time
 import random
+import copy
+import io
+import json
+import logging
 import hashlib
-import platform
+import functools
+import itertools
+import shutil
 import subprocess
-import uuid
+import types
+import atexit
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
+import requests.adapters
 import asyncio
-from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Any
 
 import yt_dlp
+from yt_dlp.networking.impersonate import ImpersonateTarget
+
+logger = logging.getLogger(__name__)
 
 # -----------------------------
 # Configuration
@@ -21,64 +34,206 @@ import yt_dlp
 DOWNLOAD_DIR = os.path.join(os.getcwd(), "downloads")
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-# Simple in-memory cache
-_video_cache: Dict[str, Dict[str, Any]] = {}
+# Downloaded-file cache, persisted as a JSON sidecar so it survives restarts
+VIDEO_CACHE_FILE = os.path.join(DOWNLOAD_DIR, ".cache.json")
+VIDEO_CACHE_TTL = 24 * 3600
+VIDEO_CACHE_MAX = 1024
+
+def _load_video_cache() -> "OrderedDict[str, Dict[str, Any]]":
+    try:
+        with open(VIDEO_CACHE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return OrderedDict()
+    # Saved oldest-first, so the file order is the LRU order
+    return OrderedDict(data) if isinstance(data, dict) else OrderedDict()
+
+_video_cache: "OrderedDict[str, Dict[str, Any]]" = _load_video_cache()
+_video_cache_lock = threading.Lock()
+_download_locks: Dict[str, threading.Lock] = {}
+_download_locks_guard = threading.Lock()
+
+# Format listings per normalized URL, so /download doesn't re-extract what /formats just did.
+# Saved on exit so a restart doesn't send every recently viewed video back to YouTube.
+FORMATS_CACHE_FILE = os.path.join(DOWNLOAD_DIR, ".formats.json")
+
+def _load_formats_cache() -> "OrderedDict[str, Dict[str, Any]]":
+    try:
+        with open(FORMATS_CACHE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return OrderedDict()
+    if not isinstance(data, dict):
+        return OrderedDict()
+    # Expiries are stored as wall-clock time; the in-memory cache runs on the monotonic clock
+    mono_now = time.monotonic()
+    skew = mono_now - time.time()
+    out: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    for url, entry in data.items():
+        try:
+            expires = float(entry["expires"]) + skew
+            formats = entry["formats"]
+        except (KeyError, TypeError, ValueError):
+            continue
+        if expires > mono_now:
+            out[url] = {"formats": formats, "expires": expires}
+    return out
+
+_formats_cache: "OrderedDict[str, Dict[str, Any]]" = _load_formats_cache()
+_formats_cache_lock = threading.Lock()
+_formats_locks: Dict[str, threading.Lock] = {}
+_formats_locks_guard = threading.Lock()
+
+# Raw extract_info results per normalized URL, reused by download_video within a short window.
+# Each one can run to a megabyte, so only a few are kept, minus the fields a download never uses.
+_info_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_info_cache_lock = threading.Lock()
+INFO_CACHE_TTL = 5 * 60  # seconds; well inside the lifetime of the signed format URLs
+INFO_CACHE_MAX = 64
+_INFO_DROP_KEYS = frozenset({"automatic_captions", "subtitles", "thumbnails", "heatmap"})
+
+# Metadata extraction reuses one YoutubeDL per thread; constructing one costs ~60 ms
+_ydl_local = threading.local()
+_ydl_pool: set = set()
+_ydl_pool_lock = threading.Lock()
+YDL_REUSE_MAX = 50
+FORMATS_CACHE_TTL = 3600  # seconds
+FORMATS_CACHE_MAX = 4096
 
 # Optional cookies file (fallback when --cookies-from-browser is not used)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 COOKIES_TXT = os.path.join(os.path.dirname(SCRIPT_DIR), "youtube_cookies.txt")
+HAS_COOKIES_TXT = os.path.exists(COOKIES_TXT)
 
 # Networking / retry tuning
-RATE_LIMIT_BPS = 6_000_000         # 6 MB/s
-HTTP_CHUNK_SIZE = 4 * 1024 * 1024  # 4MB
+# Bytes/s cap on downloads; unlimited unless YTDLP_RATE_LIMIT opts in
+RATE_LIMIT_BPS = int(os.environ.get("YTDLP_RATE_LIMIT", "0"))
+HTTP_CHUNK_SIZE = 10 * 1024 * 1024  # 10MB, yt-dlp's recommended size for dodging YouTube throttling
 RETRIES = 15
 FRAG_RETRIES = 15
 RETRY_SLEEP = "exponential:1.5"
-SOCKET_TIMEOUT = 30
+RETRY_BACKOFF_BASE = 1.0   # seconds, download_with_retry
+RETRY_BACKOFF_CAP = 30.0
+RETRY_DEADLINE = float(os.environ.get("YTDLP_RETRY_DEADLINE", "300"))  # seconds across all attempts
+SOCKET_TIMEOUT = 15  # short, so dead pooled connections are dropped quickly
+# Errors from yt-dlp that no retry can fix
+PERMANENT_ERROR_MARKERS = (
+    "Video unavailable",
+    "Private video",
+    "This video is not available",
+    "This video has been removed",
+    "Sign in to confirm your age",
+)
+# Player client to try first for every request (e.g. "ios"); read once, nothing changes it at runtime
+OVERRIDE_CLIENT = os.environ.get("YTDLP_OVERRIDE_CLIENT", "").strip().lower()
+# Full yt-dlp chatter (debug lines, warnings, progress) for troubleshooting only
+YTDLP_VERBOSE = os.environ.get("YTDLP_VERBOSE", "").strip().lower() in ("1", "true", "yes")
+# Random pre-download pauses; off unless asked for or running anonymously on Render (see _humanize_delays)
+AGGRESSIVE_HUMANIZATION = os.environ.get("YTDLP_HUMANIZE", "").strip().lower() in ("1", "true", "yes")
+CONCURRENT_FRAGMENTS = int(os.environ.get("YTDLP_CONCURRENT_FRAGMENTS", "5"))
+# Split progressive (non-fragmented) downloads over several connections when aria2c is installed
+ARIA2C_ARGS = ["-x16", "-s16", "-k1M", "--file-allocation=none"]
 
 # Browser rotation options
-MOBILE_USER_AGENTS = [
+MOBILE_USER_AGENTS = (
     "Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Mobile/15E148 Safari/604.1",
     "Mozilla/5.0 (iPad; CPU OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Mobile/15E148 Safari/604.1",
     "Mozilla/5.0 (Linux; Android 13; SM-S908B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Mobile Safari/537.36",
     "Mozilla/5.0 (Android 13; Mobile; rv:109.0) Gecko/114.0 Firefox/114.0",
     "Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/114.0.5735.99 Mobile/15E148 Safari/604.1",
-]
+)
 
-DESKTOP_USER_AGENTS = [
+DESKTOP_USER_AGENTS = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/114.0",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Safari/605.1.15",
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36 Edg/114.0.1823.51",
-]
+)
+
+# Fallback rotation: 2 mobile to 3 desktop (the old 40% mobile split) without an RNG draw per call
+_MOBILE_UA_CYCLE = itertools.cycle(MOBILE_USER_AGENTS)
+_DESKTOP_UA_CYCLE = itertools.cycle(DESKTOP_USER_AGENTS)
+_UA_SLOTS = itertools.cycle((_DESKTOP_UA_CYCLE, _MOBILE_UA_CYCLE, _DESKTOP_UA_CYCLE, _DESKTOP_UA_CYCLE, _MOBILE_UA_CYCLE))
 
 # Browser fingerprints for consistency
-BROWSER_FINGERPRINTS = [
+BROWSER_FINGERPRINTS = (
     {"name": "chrome", "version": "114.0.5735.134", "platform": "Windows"},
     {"name": "chrome", "version": "114.0.5735.133", "platform": "macOS"},
     {"name": "firefox", "version": "114.0.2", "platform": "Windows"},
     {"name": "firefox", "version": "114.0.1", "platform": "macOS"},
     {"name": "safari", "version": "16.5", "platform": "macOS"},
     {"name": "edge", "version": "114.0.1823.51", "platform": "Windows"},
-]
+)
+
+# Simple resolution tokens mapped to robust selectors (read-only, shared by every call)
+_SELECTOR_MAP = types.MappingProxyType({
+    "best": "bestvideo[ext=mp4]+bestaudio/best",
+    "1080": "bestvideo[height<=1080][ext=mp4]+bestaudio/best/best[height<=1080][ext=mp4]/best",
+    "720":  "bestvideo[height<=720][ext=mp4]+bestaudio/best/best[height<=720][ext=mp4]/best",
+    "480":  "bestvideo[height<=480][ext=mp4]+bestaudio/best/best[height<=480][ext=mp4]/best",
+    "360":  "bestvideo[height<=360][ext=mp4]+bestaudio/best/best[height<=360][ext=mp4]/best",
+})
+
+# Request headers that don't depend on the per-request fingerprint
+_BASE_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-User": "?1",
+    "Referer": "https://www.youtube.com/",
+    "Origin": "https://www.youtube.com",
+    "Dnt": "1",
+    "Upgrade-Insecure-Requests": "1",
+    "Connection": "keep-alive",
+}
+
+_PLAYER_CLIENTS = ("web", "android", "ios", "mweb", "tv", "web_embedded")
+# All 720 orderings up front, so a random order is one choice() instead of a shuffle
+_PLAYER_CLIENT_ORDERS = tuple(itertools.permutations(_PLAYER_CLIENTS))
+
+# youtu.be/<id>, youtube.com/shorts/<id>, /embed/<id> and /watch?...v=<id> in a single scan
+_YT_ID_RE = re.compile(
+    r"(?:^|[/.])(?:youtu\.be/|youtube\.com/(?:shorts/|embed/|watch\?(?:[^#]*&)?v=))"
+    r"([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])"
+)
 
 # -----------------------------
 # Utilities
 # -----------------------------
 def _hc(s: str) -> str:
-    return hashlib.md5(s.encode("utf-8", errors="ignore")).hexdigest()
+    # Non-cryptographic cache key; BLAKE2b is faster than MD5 on short strings
+    return hashlib.blake2b(s.encode("utf-8", errors="ignore"), digest_size=8).hexdigest()
 
-def _now() -> datetime:
-    return datetime.now()
+def _now() -> float:
+    # In-memory TTLs only need elapsed time; the monotonic clock is cheap and ignores wall-clock jumps
+    return time.monotonic()
 
+@functools.lru_cache(maxsize=1)
 def _is_render_environment() -> bool:
     """Detect if running on Render"""
     return "RENDER" in os.environ or os.path.exists("/opt/render")
 
+_rng_local = threading.local()
+
+def _rng() -> random.Random:
+    """Per-thread generator, so concurrent requests don't all draw from the module-level one"""
+    rng = getattr(_rng_local, "rng", None)
+    if rng is None:
+        rng = _rng_local.rng = random.Random()
+    return rng
+
+def _humanize_delays() -> bool:
+    """Pause like a person only where it buys anything: opted in, or Render without real cookies"""
+    if AGGRESSIVE_HUMANIZATION:
+        return True
+    return _is_render_environment() and not HAS_COOKIES_TXT and not os.environ.get("YTDLP_COOKIES_FROM_BROWSER")
+
 def get_random_fingerprint() -> Dict[str, str]:
     """Get a consistent browser fingerprint for better disguising"""
-    return random.choice(BROWSER_FINGERPRINTS)
+    return _rng().choice(BROWSER_FINGERPRINTS)
 
 def get_random_user_agent(fingerprint: Optional[Dict[str, str]] = None) -> str:
     """Get a random but realistic user agent string, optionally matching a fingerprint"""
@@ -99,32 +254,40 @@ def get_random_user_agent(fingerprint: Optional[Dict[str, str]] = None) -> str:
         elif browser == "edge":
             return f"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{fingerprint['version'].split('.')[0]}.0.0.0 Safari/537.36 Edg/{fingerprint['version']}"
     
-    # If no fingerprint or not matched, return random
-    is_mobile = random.random() < 0.4  # 40% chance of mobile
-    if is_mobile:
-        return random.choice(MOBILE_USER_AGENTS)
-    else:
-        return random.choice(DESKTOP_USER_AGENTS)
+    # If no fingerprint or not matched, take the next one in the rotation
+    return next(next(_UA_SLOTS))
+
+# Minimal cookies are generated as text and handed to each YoutubeDL as its own in-memory file.
+# yt-dlp writes its jar back to the cookie file on close, so one shared file on disk would be
+# rewritten in place while other downloads are loading it.
+MINIMAL_COOKIES_MAX_AGE = 30 * 60  # rotate the fake visitor identity every 30 minutes
+_minimal_cookies_text = ""
+_minimal_cookies_ts = float("-inf")  # monotonic; -inf so the first call always generates
+_minimal_cookies_lock = threading.Lock()
 
 def generate_minimal_cookies() -> str:
-    """Generate minimal cookies file with just enough to avoid bot detection"""
-    cookies_path = os.path.join(DOWNLOAD_DIR, f"temp_cookies_{uuid.uuid4().hex[:8]}.txt")
-    
-    # These are placeholder values to make YouTube think we're a normal user
-    minimal_cookies = [
-        "# Netscape HTTP Cookie File",
-        "# This is a generated file. Do not edit.",
-        "",
-        f".youtube.com\tTRUE\t/\tFALSE\t{int(time.time()) + 3600*24*365*2}\tPREF\tf6=40000000&tz=Asia.Tokyo",
-        f".youtube.com\tTRUE\t/\tFALSE\t{int(time.time()) + 3600*24*365*2}\tCONSENT\tYES+cb.20210328-17-p0.en+FX+{random.randint(100, 999)}",
-        f".youtube.com\tTRUE\t/\tFALSE\t{int(time.time()) + 3600*24*365*2}\tVISITOR_INFO1_LIVE\t{random.randint(1000000, 9999999)}.{int(time.time())}.{random.randint(1000000, 9999999)}",
-        f".youtube.com\tTRUE\t/\tFALSE\t{int(time.time()) + 3600*24*365*2}\tYSC\t{hashlib.md5(str(time.time()).encode()).hexdigest()[:16]}",
-    ]
-    
-    with open(cookies_path, "w") as f:
-        f.write("\n".join(minimal_cookies))
-    
-    return cookies_path
+    """Generate minimal Netscape-format cookies with just enough to avoid bot detection"""
+    global _minimal_cookies_text, _minimal_cookies_ts
+    with _minimal_cookies_lock:
+        if _now() - _minimal_cookies_ts < MINIMAL_COOKIES_MAX_AGE:
+            return _minimal_cookies_text
+
+        # These are placeholder values to make YouTube think we're a normal user
+        now = time.time()
+        rng = _rng()
+        expiry = int(now) + 63072000  # two years
+        cookie = f".youtube.com\tTRUE\t/\tFALSE\t{expiry}\t"
+        _minimal_cookies_text = "".join((
+            "# Netscape HTTP Cookie File\n",
+            "# This is a generated file. Do not edit.\n",
+            "\n",
+            f"{cookie}PREF\tf6=40000000&tz=Asia.Tokyo\n",
+            f"{cookie}CONSENT\tYES+cb.20210328-17-p0.en+FX+{rng.randint(100, 999)}\n",
+            f"{cookie}VISITOR_INFO1_LIVE\t{rng.randint(1000000, 9999999)}.{int(now)}.{rng.randint(1000000, 9999999)}\n",
+            f"{cookie}YSC\t{hashlib.blake2b(str(now).encode(), digest_size=8).hexdigest()}\n",
+        ))
+        _minimal_cookies_ts = _now()
+        return _minimal_cookies_text
 
 def _get_proxy() -> Optional[str]:
     """Get a proxy server if available"""
@@ -136,96 +299,125 @@ def _get_proxy() -> Optional[str]:
     # You could implement rotation from a list or proxy service
     return None
 
+@functools.lru_cache(maxsize=8192)
 def normalize_youtube_url(url: str) -> str:
     """
     Normalize to canonical https://www.youtube.com/watch?v=<11-char-id>
     Supports youtu.be, shorts, embed, etc. Do NOT convert to youtube-nocookie.
     """
     url = url.strip()
-
-    # youtu.be/<id>
-    m = re.match(r"^https?://(?:www\.)?youtu\.be/([A-Za-z0-9_-]{11})(?:[?&].*)?$", url)
-    if m:
-        return f"https://www.youtube.com/watch?v={m.group(1)}"
-
-    # youtube.com/shorts/<id>
-    m = re.match(r"^https?://(?:www\.)?youtube\.com/shorts/([A-Za-z0-9_-]{11})(?:[?&].*)?$", url)
-    if m:
-        return f"https://www.youtube.com/watch?v={m.group(1)}"
-
-    # youtube.com/embed/<id>
-    m = re.match(r"^https?://(?:www\.)?youtube\.com/embed/([A-Za-z0-9_-]{11})(?:[?&].*)?$", url)
-    if m:
-        return f"https://www.youtube.com/watch?v={m.group(1)}"
-
-    # youtube.com/watch?v=<id>
-    m = re.search(r"[?&]v=([A-Za-z0-9_-]{11})", url)
+    m = _YT_ID_RE.search(url)
     if m:
         return f"https://www.youtube.com/watch?v={m.group(1)}"
-
     return url
 
+@functools.lru_cache(maxsize=1)
 def check_ffmpeg() -> Tuple[bool, Optional[str], Optional[str]]:
     try:
-        p = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False)
+        p = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
         if p.returncode == 0:
-            version = p.stdout.splitlines()[0].strip()
-            ffmpeg_path = None
-            if platform.system() == "Windows":
-                w = subprocess.run(["where", "ffmpeg"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False)
-                if w.returncode == 0 and w.stdout.strip():
-                    ffmpeg_path = w.stdout.splitlines()[0].strip()
-            else:
-                w = subprocess.run(["which", "ffmpeg"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False)
-                if w.returncode == 0 and w.stdout.strip():
-                    ffmpeg_path = w.stdout.strip()
-            print(f"✅ FFmpeg: {version} ({ffmpeg_path or 'in PATH'})")
+            version = p.stdout.partition(b"\n")[0].decode(errors="replace").strip()
+            # PATH walk in-process instead of spawning where/which
+            ffmpeg_path = shutil.which("ffmpeg")
+            logger.info("✅ FFmpeg: %s (%s)", version, ffmpeg_path or "in PATH")
             return True, version, ffmpeg_path
-        print("❌ FFmpeg reported non-zero exit")
+        logger.error("❌ FFmpeg reported non-zero exit")
     except Exception as e:
-        print(f"❌ FFmpeg check error: {e}")
+        logger.error("❌ FFmpeg check error: %s", e)
     return False, None, None
 
+@functools.lru_cache(maxsize=1)
 def check_aria2c() -> bool:
+    # Only presence matters, so a PATH lookup is enough; no need to spawn aria2c --version
+    ok = shutil.which("aria2c") is not None
+    if ok:
+        logger.info("✅ aria2c available")
+    else:
+        logger.info("❌ aria2c not available")
+    return ok
+
+def _file_size(path: str) -> int:
+    """Size in bytes, or 0 when the file is missing (one stat instead of exists + getsize)"""
     try:
-        p = subprocess.run(["aria2c", "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False)
-        ok = p.returncode == 0
-        print("✅ aria2c available" if ok else "❌ aria2c not available")
-        return ok
-    except Exception:
-        print("❌ aria2c not available")
-        return False
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+def _video_cache_key(url: str, fmt: str) -> str:
+    # Key on the video ID so every URL shape of the same video shares an entry. The ID is
+    # already short and JSON-safe, so only arbitrary non-YouTube URLs get hashed.
+    m = _YT_ID_RE.search(normalize_youtube_url(url))
+    return f"{m.group(1) if m else _hc(url)}::{fmt}"
+
+def _save_video_cache() -> None:
+    tmp = f"{VIDEO_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_video_cache, f)
+        os.replace(tmp, VIDEO_CACHE_FILE)
+    except OSError as e:
+        logger.warning("⚠️ Could not persist video cache: %s", e)
 
 def _get_cache_path(url: str, fmt: str) -> Optional[str]:
-    key = _hc(f"{url}::{fmt}")
-    entry = _video_cache.get(key)
-    if entry and os.path.exists(entry["path"]) and (_now() - entry["ts"] < timedelta(hours=24)):
+    key = _video_cache_key(url, fmt)
+    with _video_cache_lock:
+        entry = _video_cache.get(key)
+        if entry:
+            _video_cache.move_to_end(key)
+    if not entry:
+        return None
+    now = time.time()
+    if now - entry["ts"] >= VIDEO_CACHE_TTL:
+        return None
+    # Entries may come from a previous process, so re-validate the file itself. Only its size:
+    # entry["ts"] already enforces the TTL, and the mtime says nothing about when we fetched it.
+    if _file_size(entry["path"]) > 0:
         return entry["path"]
     return None
 
 def _set_cache(url: str, fmt: str, path: str) -> None:
-    key = _hc(f"{url}::{fmt}")
-    _video_cache[key] = {"path": path, "ts": _now()}
+    key = _video_cache_key(url, fmt)
+    # Held across the save too, so json.dump never sees the dict change mid-write
+    with _video_cache_lock:
+        _video_cache[key] = {"path": path, "ts": time.time()}
+        _video_cache.move_to_end(key)
+        while len(_video_cache) > VIDEO_CACHE_MAX:
+            _video_cache.popitem(last=False)
+        _save_video_cache()
+
+def prune_video_cache() -> int:
+    """Drop expired entries and ones whose file is gone, returning how many were removed"""
+    cutoff = time.time() - VIDEO_CACHE_TTL
+    with _video_cache_lock:
+        stale = [k for k, e in _video_cache.items() if e["ts"] < cutoff or not _file_size(e["path"])]
+        for k in stale:
+            del _video_cache[k]
+        if stale:
+            _save_video_cache()
+    return len(stale)
 
 def _get_player_tokens() -> Dict[str, str]:
     """Generate tokens that look like YouTube player tokens"""
-    current_time = int(time.time())
-    web_token = f"web+{hashlib.md5(str(current_time).encode()).hexdigest()[:10]}"
-    android_token = f"android+{hashlib.md5(str(current_time + 1).encode()).hexdigest()[:10]}"
-    ios_token = f"ios+{hashlib.md5(str(current_time + 2).encode()).hexdigest()[:10]}"
-    
-    return {
-        "web": web_token,
-        "android": android_token,
-        "ios": ios_token
-    }
+    # Hash the timestamp once and fork the state per client instead of three full hashes
+    seed = hashlib.blake2b(str(int(time.time())).encode(), digest_size=8)
+    tokens = {}
+    for client in ("web", "android", "ios"):
+        h = seed.copy()
+        h.update(client.encode())
+        tokens[client] = f"{client}+{h.hexdigest()[:10]}"
+    return tokens
+
+# One pooled session for the warm-up GETs, so repeat visits skip the TCP/TLS handshake.
+# Headers go per request (never session.headers) so concurrent callers don't share a fingerprint.
+_WARMUP_SESSION = requests.Session()
+_WARMUP_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=0))
 
 def _create_realistic_session(url: str) -> None:
     """Create a more realistic browsing session before downloading"""
     try:
         # This simulates a user browsing pattern
         fingerprint = get_random_fingerprint()
-        session = requests.Session()
+        session = _WARMUP_SESSION
         ua = get_random_user_agent(fingerprint)
         
         headers = {
@@ -241,21 +433,17 @@ def _create_realistic_session(url: str) -> None:
             "Sec-Fetch-Site": "none",
             "Sec-Fetch-User": "?1",
         }
-        session.headers.update(headers)
-        
-        # First visit YouTube homepage
-        session.get("https://www.youtube.com/")
-        time.sleep(random.uniform(0.5, 1.5))
-        
-        # Then visit the video page (but don't download)
-        session.get(url)
-        time.sleep(random.uniform(0.8, 2.0))
-        
-        # Maybe visit another related page
-        session.get("https://www.youtube.com/feed/trending")
         
+        # Homepage, the video page (but don't download) and a related page. None depends on
+        # another, so fetch them side by side instead of paying three round trips plus sleeps.
+        pages = ("https://www.youtube.com/", url, "https://www.youtube.com/feed/trending")
+        with ThreadPoolExecutor(max_workers=len(pages)) as pool:
+            futures = [pool.submit(session.get, page, headers=headers, timeout=SOCKET_TIMEOUT) for page in pages]
+            for future in futures:
+                future.result()
+
     except Exception as e:
-        print(f"Session prep failed (non-critical): {e}")
+        logger.info("Session prep failed (non-critical): %s", e)
 
 def _choose_cookies(ydl_opts: Dict[str, Any]) -> None:
     """
@@ -269,121 +457,98 @@ def _choose_cookies(ydl_opts: Dict[str, Any]) -> None:
         browser = parts[0].strip().lower()
         profile = parts[1].strip() if len(parts) > 1 else None
         ydl_opts["cookiesfrombrowser"] = (browser, profile, None, None)
-        print(f"🍪 Using cookies-from-browser: {browser}{(':'+profile) if profile else ''}")
+        logger.info("🍪 Using cookies-from-browser: %s%s", browser, (":" + profile) if profile else "")
         return
         
-    if os.path.exists(COOKIES_TXT):
+    if HAS_COOKIES_TXT:
         ydl_opts["cookiefile"] = COOKIES_TXT
-        print(f"🍪 Using cookies file: {COOKIES_TXT}")
+        logger.info("🍪 Using cookies file: %s", COOKIES_TXT)
         return
         
     # If no cookies and on Render, generate minimal cookies
-    if _is_render_environment() or random.random() < 0.7:  # 70% chance to use minimal cookies anyway
-        minimal_cookies = generate_minimal_cookies()
-        ydl_opts["cookiefile"] = minimal_cookies
-        print(f"🍪 Using generated minimal cookies: {minimal_cookies}")
+    if _is_render_environment() or _rng().random() < 0.7:  # 70% chance to use minimal cookies anyway
+        # A fresh in-memory file per YoutubeDL, so its save on close can't clobber anyone else's
+        ydl_opts["cookiefile"] = io.StringIO(generate_minimal_cookies())
+        logger.info("🍪 Using generated minimal cookies")
         return
         
-    print("⚠️ No cookies configured. Protected videos may require authentication.")
+    logger.warning("⚠️ No cookies configured. Protected videos may require authentication.")
 
 def _apply_render_specific_settings(opts: Dict[str, Any]) -> None:
     """Apply Render-specific optimizations"""
     if _is_render_environment():
-        print("🖥️ Detected Render environment, applying optimizations")
+        logger.info("🖥️ Detected Render environment, applying optimizations")
         # Render seems to struggle with the default settings
         opts["socket_timeout"] = 60  # Longer timeout
         
         # These options help with avoiding the bot detection
         opts["sleep_interval"] = 1  # Add delay between requests
         opts["max_sleep_interval"] = 5
-        
-        # Try to avoid predictable patterns
-        mobile_first = random.choice([True, False])
-        if mobile_first:
-            # Mobile clients first
-            opts["extractor_args"]["youtube"]["player_client"] = ["ios", "android", "web", "mweb", "tv", "web_embedded"]
-        else:
-            # Desktop clients first
-            opts["extractor_args"]["youtube"]["player_client"] = ["web", "web_embedded", "tv", "ios", "android", "mweb"]
-            
-        # Add some player tokens
-        tokens = _get_player_tokens()
-        if "po_token" not in opts["extractor_args"]["youtube"]:
-            opts["extractor_args"]["youtube"]["po_token"] = []
-        opts["extractor_args"]["youtube"]["po_token"].extend([tokens["web"], tokens["android"], tokens["ios"]])
 
-def _build_common_opts() -> Dict[str, Any]:
-    ff_ok, _, ff_path = check_ffmpeg()
+class _YDLLogger:
+    """Route yt-dlp output to the app logger instead of the shared stderr stream"""
 
-    # Get consistent browser fingerprint for this request
-    fingerprint = get_random_fingerprint()
-    user_agent = get_random_user_agent(fingerprint)
-    
-    # More realistic headers with browser consistency
-    headers = {
-        "User-Agent": user_agent,
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-        "Accept-Language": "en-US,en;q=0.9",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Site": random.choice(["none", "same-origin"]),
-        "Sec-Fetch-Dest": "document",
-        "Sec-Fetch-User": "?1",
-        "Sec-Ch-Ua": f'"{fingerprint["name"]}"',
-        "Sec-Ch-Ua-Mobile": "?0" if fingerprint["name"] in ["chrome", "firefox", "edge"] else "?1",
-        "Sec-Ch-Ua-Platform": f'"{fingerprint["platform"]}"',
-        "Referer": "https://www.youtube.com/",
-        "Origin": "https://www.youtube.com",
-        "Dnt": "1",
-        "Upgrade-Insecure-Requests": "1",
-    }
+    def debug(self, msg: str) -> None:
+        # yt-dlp sends all screen, progress and verbose output here; surface it at INFO when
+        # asked for, since the app logs at INFO by default
+        if YTDLP_VERBOSE:
+            logger.info(msg)
 
-    # Get player tokens for anti-bot measures
-    tokens = _get_player_tokens()
-    
-    # Check for forced client preference from environment
-    forced_client = os.environ.get("YTDLP_OVERRIDE_CLIENT", "").strip().lower()
-    player_clients = []
-    if forced_client in ["ios", "android", "web", "mweb", "tv"]:
-        # Put the forced client first, then others
-        player_clients = [forced_client] + [c for c in ["web", "android", "ios", "mweb", "tv", "web_embedded"] if c != forced_client]
+    def warning(self, msg: str) -> None:
+        logger.warning(msg)
+
+    def error(self, msg: str) -> None:
+        logger.error(msg)
+
+@functools.lru_cache(maxsize=1)
+def _impersonate_clients() -> frozenset:
+    """Browser families yt-dlp can impersonate here (empty when curl_cffi isn't installed)"""
+    try:
+        with yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True}) as ydl:
+            clients = frozenset(t.client for t, _ in ydl._get_available_impersonate_targets() if t.client)
+    except Exception as e:
+        logger.warning("⚠️ Impersonation probe failed: %s", e)
+        return frozenset()
+    if clients:
+        logger.info("✅ Impersonation available: %s", ", ".join(sorted(clients)))
     else:
-        # Default client order with slight randomization
-        all_clients = ["web", "android", "ios", "mweb", "tv", "web_embedded"]
-        random.shuffle(all_clients)
-        player_clients = all_clients
+        logger.info("ℹ️ Impersonation unavailable (curl_cffi not installed)")
+    return clients
+
+@functools.lru_cache(maxsize=1)
+def _build_common_opts_template() -> Dict[str, Any]:
+    """Options that are the same for every call in this process (probes run once)"""
+    ff_ok, _, ff_path = check_ffmpeg()
 
     opts: Dict[str, Any] = {
-        "outtmpl": os.path.join(DOWNLOAD_DIR, "%(title)s.%(ext)s"),
+        # Byte-capped title so long titles can't exceed NAME_MAX; the ID keeps same-titled videos
+        # apart and the format ID keeps each quality of one video in its own file
+        "outtmpl": os.path.join(DOWNLOAD_DIR, "%(title).150B-%(id)s-%(format_id)s.%(ext)s"),
         "noplaylist": True,
-        "quiet": False,
-        "verbose": True,
-        "no_warnings": False,
+        "quiet": not YTDLP_VERBOSE,
+        "verbose": YTDLP_VERBOSE,
+        "no_warnings": not YTDLP_VERBOSE,
+        "noprogress": not YTDLP_VERBOSE,
+        "logger": _YDLLogger(),
         "nocheckcertificate": True,
+        # Keep the download time as mtime instead of the server's Last-Modified, so the cleanup
+        # sweep in main.py ages files from when we fetched them
+        "updatetime": False,
 
         "socket_timeout": SOCKET_TIMEOUT,
         "retries": RETRIES,
         "fragment_retries": FRAG_RETRIES,
         "retry_sleep": RETRY_SLEEP,
 
-        "ratelimit": RATE_LIMIT_BPS,
+        "ratelimit": RATE_LIMIT_BPS or None,
         "http_chunk_size": HTTP_CHUNK_SIZE,
-        "concurrent_fragment_downloads": 1,
+        "concurrent_fragment_downloads": CONCURRENT_FRAGMENTS,
 
         "hls_prefer_ffmpeg": True,
         "hls_use_mpegts": False,
 
         "geo_bypass": True,
 
-        "extractor_args": {
-            "youtube": {
-                "player_client": player_clients,
-                "po_token": [tokens["web"], tokens["android"], tokens["ios"]],
-            }
-        },
-
-        "http_headers": headers,
-
         "prefer_ffmpeg": ff_ok,
         "merge_output_format": "mp4",
     }
@@ -392,11 +557,74 @@ def _build_common_opts() -> Dict[str, Any]:
     proxy = _get_proxy()
     if proxy:
         opts["proxy"] = proxy
-        print(f"🔄 Using proxy: {proxy}")
+        logger.info("🔄 Using proxy: %s", proxy)
 
     if ff_ok and ff_path:
         opts["ffmpeg_location"] = os.path.dirname(ff_path)
 
+    if check_aria2c():
+        # Only plain http(s) streams; DASH/HLS fragments use the native concurrent downloader
+        opts["external_downloader"] = {"http": "aria2c"}
+        opts["external_downloader_args"] = {"aria2c": ARIA2C_ARGS}
+
+    return opts
+
+def _player_extractor_args(forced_client: Optional[str] = None) -> Dict[str, Any]:
+    """Per-call player client order and tokens (yt-dlp reads these on every extraction)"""
+    # Get player tokens for anti-bot measures
+    tokens = _get_player_tokens()
+    
+    # Check for forced client preference from the caller, then the environment
+    forced_client = forced_client or OVERRIDE_CLIENT
+    player_clients = []
+    if forced_client in ("ios", "android", "web", "mweb", "tv"):
+        # Put the forced client first, then others
+        player_clients = [forced_client] + [c for c in _PLAYER_CLIENTS if c != forced_client]
+    else:
+        # Default client order with slight randomization
+        player_clients = list(_rng().choice(_PLAYER_CLIENT_ORDERS))
+    po_tokens = [tokens["web"], tokens["android"], tokens["ios"]]
+
+    if _is_render_environment():
+        # Try to avoid predictable patterns, unless a specific client was asked for
+        if forced_client not in _PLAYER_CLIENTS:
+            mobile_first = _rng().getrandbits(1)
+            if mobile_first:
+                # Mobile clients first
+                player_clients = ["ios", "android", "web", "mweb", "tv", "web_embedded"]
+            else:
+                # Desktop clients first
+                player_clients = ["web", "web_embedded", "tv", "ios", "android", "mweb"]
+
+        # Add some player tokens
+        tokens = _get_player_tokens()
+        po_tokens.extend([tokens["web"], tokens["android"], tokens["ios"]])
+
+    return {"youtube": {"player_client": player_clients, "po_token": po_tokens}}
+
+def _build_common_opts(forced_client: Optional[str] = None) -> Dict[str, Any]:
+    # Get consistent browser fingerprint for this request
+    fingerprint = get_random_fingerprint()
+    user_agent = get_random_user_agent(fingerprint)
+    
+    # More realistic headers with browser consistency
+    headers = {
+        "User-Agent": user_agent,
+        **_BASE_HEADERS,
+        "Sec-Fetch-Site": ("none", "same-origin")[_rng().getrandbits(1)],
+        "Sec-Ch-Ua": f'"{fingerprint["name"]}"',
+        "Sec-Ch-Ua-Mobile": "?0" if fingerprint["name"] in ("chrome", "firefox", "edge") else "?1",
+        "Sec-Ch-Ua-Platform": f'"{fingerprint["platform"]}"',
+    }
+
+    # Shallow copy is enough: everything set per call below is a fresh object
+    opts = dict(_build_common_opts_template())
+    opts["http_headers"] = headers
+    opts["extractor_args"] = _player_extractor_args(forced_client)
+    # Matching TLS fingerprint, and curl_cffi reuses HTTP/2 connections across fragments
+    if fingerprint["name"] in _impersonate_clients():
+        opts["impersonate"] = ImpersonateTarget(fingerprint["name"])
+
     # Configure cookies
     _choose_cookies(opts)
     
@@ -405,28 +633,89 @@ def _build_common_opts() -> Dict[str, Any]:
     
     return opts
 
+def _close_ydl(ydl: yt_dlp.YoutubeDL) -> None:
+    with _ydl_pool_lock:
+        _ydl_pool.discard(ydl)
+    try:
+        ydl.close()
+    except Exception as e:
+        logger.warning("⚠️ Closing YoutubeDL failed: %s", e)
+
+def _listing_ydl() -> yt_dlp.YoutubeDL:
+    """This thread's long-lived YoutubeDL for metadata extraction (instances aren't thread-safe)"""
+    ydl = getattr(_ydl_local, "ydl", None)
+    if ydl is not None and _ydl_local.uses < YDL_REUSE_MAX:
+        # Headers and cookies stay with the instance; client order and tokens still rotate per call
+        ydl.params["extractor_args"] = _player_extractor_args()
+        _ydl_local.uses += 1
+        return ydl
+    if ydl is not None:
+        # Retire it periodically so the fingerprint and cookies still rotate
+        _close_ydl(ydl)
+    opts = _build_common_opts()
+    opts["skip_download"] = True
+    ydl = yt_dlp.YoutubeDL(opts)
+    with _ydl_pool_lock:
+        _ydl_pool.add(ydl)
+    _ydl_local.ydl = ydl
+    _ydl_local.uses = 1
+    return ydl
+
+def _discard_listing_ydl() -> None:
+    ydl = getattr(_ydl_local, "ydl", None)
+    if ydl is not None:
+        _ydl_local.ydl = None
+        _close_ydl(ydl)
+
+@atexit.register
+def _close_ydl_pool() -> None:
+    with _ydl_pool_lock:
+        pool = list(_ydl_pool)
+    for ydl in pool:
+        _close_ydl(ydl)
+
 def _extract_info_guard(ydl: yt_dlp.YoutubeDL, url: str, download: bool) -> Dict[str, Any]:
-    info = ydl.extract_info(url, download=download)
+    # Resolve without processing first, so a playlist result only ever has its first entry processed
+    info = ydl.extract_info(url, download=False, process=False)
+    if info is None:
+        raise yt_dlp.utils.DownloadError("extract_info returned None (likely blocked/auth required).")
+    if info.get("_type") == "playlist":
+        info = next(iter(info.get("entries") or ()), None)
+        if info is None:
+            raise yt_dlp.utils.DownloadError("Playlist result has no entries")
+    info = ydl.process_ie_result(info, download=download)
     if info is None:
         raise yt_dlp.utils.DownloadError("extract_info returned None (likely blocked/auth required).")
-    if "entries" in info and isinstance(info["entries"], list) and info["entries"]:
-        info = info["entries"][0]
     return info
 
 # -----------------------------
 # Public API
 # -----------------------------
+# (YTDLP_COOKIES_FROM_BROWSER value, report) from the last check_dependencies call
+_deps_snapshot: Optional[Tuple[str, Dict[str, Any]]] = None
+
 def check_dependencies() -> Dict[str, Any]:
-    ff_ok, ff_ver, ff_path = check_ffmpeg()
-    aria = check_aria2c()
+    global _deps_snapshot
+    # Everything else in the report is fixed for the process; only the cookie env can change
+    browser_cookies = os.environ.get("YTDLP_COOKIES_FROM_BROWSER", "")
+    snapshot = _deps_snapshot
+    if snapshot is not None and snapshot[0] == browser_cookies:
+        return dict(snapshot[1])
+
+    # Each probe blocks on a child process, so run them side by side
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        ff = pool.submit(check_ffmpeg)
+        aria_future = pool.submit(check_aria2c)
+        ff_ok, ff_ver, ff_path = ff.result()
+        aria = aria_future.result()
     cookies = None
-    if os.path.exists(COOKIES_TXT):
+    if HAS_COOKIES_TXT:
         cookies = COOKIES_TXT
-    elif os.environ.get("YTDLP_COOKIES_FROM_BROWSER"):
-        cookies = f"browser:{os.environ['YTDLP_COOKIES_FROM_BROWSER']}"
+    elif browser_cookies:
+        cookies = f"browser:{browser_cookies}"
     else:
         cookies = "generated_minimal"
-    return {
+    report = {
         "ffmpeg": {"installed": ff_ok, "version": ff_ver, "path": ff_path},
         "aria2c": aria,
         "cookies": cookies,
@@ -434,65 +723,188 @@ def check_dependencies() -> Dict[str, Any]:
         "downloads_dir": DOWNLOAD_DIR,
         "environment": "render" if _is_render_environment() else "standard",
     }
+    _deps_snapshot = (browser_cookies, report)
+    return dict(report)
+
+def _get_cached_formats(url: str) -> Optional[List[Dict[str, Any]]]:
+    entry = _formats_cache.get(url)
+    if entry and entry["expires"] > _now():
+        return entry["formats"]
+    return None
+
+def _set_cached_formats(url: str, formats: List[Dict[str, Any]]) -> None:
+    with _formats_cache_lock:
+        _formats_cache[url] = {"formats": formats, "expires": _now() + FORMATS_CACHE_TTL}
+        _formats_cache.move_to_end(url)
+        while len(_formats_cache) > FORMATS_CACHE_MAX:
+            # Drop the oldest entry
+            _formats_cache.popitem(last=False)
+
+@atexit.register
+def _save_formats_cache() -> None:
+    mono_now = time.monotonic()
+    skew = time.time() - mono_now
+    with _formats_cache_lock:
+        data = {
+            url: {"formats": e["formats"], "expires": e["expires"] + skew}
+            for url, e in _formats_cache.items()
+            if e["expires"] > mono_now
+        }
+    tmp = f"{FORMATS_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, FORMATS_CACHE_FILE)
+    except OSError as e:
+        logger.warning("⚠️ Could not persist formats cache: %s", e)
+
+def clear_formats_cache() -> int:
+    """Drop all cached format listings, returning how many were removed"""
+    with _formats_cache_lock:
+        count = len(_formats_cache)
+        _formats_cache.clear()
+    # The listings are rebuilt from saved extractions, so those have to go too
+    with _info_cache_lock:
+        _info_cache.clear()
+    _save_formats_cache()
+    return count
 
 def get_video_formats(url: str) -> List[Dict[str, Any]]:
     url = normalize_youtube_url(url)
-    
+
+    cached = _get_cached_formats(url)
+    if cached is not None:
+        return cached
+
+    # Single-flight per URL: concurrent callers wait for one extraction
+    with _formats_locks_guard:
+        lock = _formats_locks.setdefault(url, threading.Lock())
+    with lock:
+        try:
+            cached = _get_cached_formats(url)
+            if cached is not None:
+                return cached
+            return _list_video_formats(url)
+        finally:
+            with _formats_locks_guard:
+                if _formats_locks.get(url) is lock:
+                    del _formats_locks[url]
+
+def _get_cached_info(url: str) -> Optional[Dict[str, Any]]:
+    with _info_cache_lock:
+        entry = _info_cache.get(url)
+        if entry and entry["expires"] > _now():
+            return entry["info"]
+        _info_cache.pop(url, None)
+    return None
+
+def _drop_cached_info(url: str) -> None:
+    with _info_cache_lock:
+        _info_cache.pop(url, None)
+
+def _set_cached_info(url: str, info: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep a trimmed copy of an extraction, returning what was stored"""
+    info = {k: v for k, v in info.items() if k not in _INFO_DROP_KEYS}
+    now = _now()
+    with _info_cache_lock:
+        # Lookups only drop the URL they were asked about, so sweep the rest here
+        for k in [k for k, e in _info_cache.items() if e["expires"] <= now]:
+            del _info_cache[k]
+        _info_cache[url] = {"info": info, "expires": now + INFO_CACHE_TTL}
+        _info_cache.move_to_end(url)
+        while len(_info_cache) > INFO_CACHE_MAX:
+            _info_cache.popitem(last=False)
+    return info
+
+def _extract_once(url: str) -> Dict[str, Any]:
+    """Extract metadata once and keep it briefly so the download can skip a second round trip"""
+    cached = _get_cached_info(url)
+    if cached is not None:
+        return cached
+
     # Create a realistic browser session first
     _create_realistic_session(url)
-    
-    ydl_opts = _build_common_opts()
-    ydl_opts.update({
-        "skip_download": True,
-        "quiet": True,
-        "no_warnings": True,
-        "verbose": False,
-    })
 
+    try:
+        info = _extract_info_guard(_listing_ydl(), url, download=False)
+    except Exception:
+        # A blocked fingerprint or cookie set shouldn't stick to this thread
+        _discard_listing_ydl()
+        raise
+    return _set_cached_info(url, info)
+
+def _list_video_formats(url: str) -> List[Dict[str, Any]]:
     out: List[Dict[str, Any]] = []
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = _extract_info_guard(ydl, url, download=False)
-            for f in info.get("formats", []):
-                if f.get("vcodec") != "none" and f.get("ext") == "mp4":
-                    h = f.get("height")
-                    if not h:
-                        continue
-                    fps = f.get("fps") or 0
-                    label = f"{h}p" + ("60" if fps >= 50 else "")
-                    out.append({
-                        "format_id": f.get("format_id"),
-                        "label": label,
-                        "ext": "mp4",
-                        "fps": fps,
-                        "filesize_mb": round((f.get("filesize") or 0) / (1024 * 1024), 2) if f.get("filesize") else None
-                    })
+        info = _extract_once(url)
+        for f in info.get("formats", ()):
+            # Cheap ext compare first; most formats are webm and drop out here
+            if f.get("ext") != "mp4" or f.get("vcodec") == "none":
+                continue
+            h = f.get("height")
+            if not h:
+                continue
+            fps = f.get("fps") or 0
+            fs = f.get("filesize")
+            out.append({
+                "format_id": f.get("format_id"),
+                "label": f"{h}p{'60' if fps >= 50 else ''}",
+                "ext": "mp4",
+                "height": h,
+                "fps": fps,
+                "filesize_mb": round(fs / 1048576, 2) if fs else None,
+            })
     except Exception as e:
-        print(f"⚠️ Format listing failed: {e}")
+        logger.warning("⚠️ Format listing failed: %s", e)
 
     if not out:
-        # Provide at least "Auto"
+        # Provide at least "Auto" (not cached, so the next call retries the extraction)
         return [{"format_id": "best", "label": "Auto"}]
 
     # Add a generic "Auto" on top to map to a robust selector
     out.insert(0, {"format_id": "best", "label": "Auto"})
+    _set_cached_formats(url, out)
     return out
 
+def is_preset_format(format_code: str) -> bool:
+    """True for "best" and the resolution tiers, which map straight to a yt-dlp selector"""
+    return format_code in _SELECTOR_MAP
+
 def get_best_available_format(url: str, target_height: int) -> str:
+    # The standard tiers have selectors that already fall back to the closest height with audio
+    tier = str(target_height)
+    if tier in _SELECTOR_MAP:
+        return tier
     fmts = get_video_formats(url)
-    pairs: List[Tuple[int, str]] = []
-    for f in fmts:
-        if f.get("format_id") and f["format_id"] != "best":
-            try:
-                # Extract int height from label (e.g. "1080p60" -> 1080)
-                h = int(re.sub(r"[^\d]", "", f.get("label", "")))
-                pairs.append((h, f["format_id"]))
-            except Exception:
-                pass
+    pairs = [(f["height"], f["format_id"]) for f in fmts if f.get("height") and f.get("format_id")]
     if not pairs:
         return "best"
-    pairs.sort(key=lambda x: (x[0] > target_height, abs(x[0] - target_height)))
-    return pairs[0][1]
+    # Closest height at or below the target wins; only go above it when nothing fits
+    return min(pairs, key=lambda x: (x[0] > target_height, abs(x[0] - target_height)))[1]
+
+def _prefetch_formats(url: str) -> None:
+    try:
+        get_video_formats(url)
+    finally:
+        # These workers are short-lived; close their per-thread YoutubeDL instead of leaking it
+        _discard_listing_ydl()
+
+def prefetch_playlist_formats(url: str, max_workers: int = 2) -> int:
+    """Warm the formats cache for every video in a playlist, returning how many were listed"""
+    # One flat pass lists the entries without resolving each video's formats
+    ydl_opts = _build_common_opts()
+    ydl_opts.update({"extract_flat": "in_playlist", "noplaylist": False})
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url.strip(), download=False) or {}
+    urls = [e["url"] for e in info.get("entries") or () if e and e.get("url")]
+    if not urls:
+        return 0
+
+    # get_video_formats is single-flight and cached, so later lookups for these videos are hits.
+    # Kept to a couple of workers: a burst of parallel extractions invites 429s and bot checks.
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch") as pool:
+        list(pool.map(_prefetch_formats, urls))
+    return len(urls)
 
 def download_audio_only(url: str, audio_format: str = "mp3") -> str:
     url = normalize_youtube_url(url)
@@ -517,85 +929,178 @@ def download_audio_only(url: str, audio_format: str = "mp3") -> str:
         candidate = f"{base}.{audio_format}"
         return candidate if os.path.exists(candidate) else out
 
-def download_video(url: str, format_code: str = "best") -> str:
-    url = normalize_youtube_url(url)
+def download_video(url: str, format_code: str = "best", player_client: Optional[str] = None) -> str:
+    return _download_video_core(normalize_youtube_url(url), format_code, player_client=player_client)
 
+def _download_video_core(url: str, format_code: str, *, player_client: Optional[str] = None, warmup: bool = True) -> str:
+    """download_video for an already-normalized URL; retries pass warmup=False after the first attempt"""
     # Check cache first
     cached = _get_cache_path(url, format_code)
     if cached:
-        print(f"🔄 Using cached file: {cached}")
+        logger.info("🔄 Using cached file: %s", cached)
         return cached
-        
-    # Create a realistic browser session first
-    _create_realistic_session(url)
+
+    # Single-flight per video and format: concurrent callers wait and then take the cached file
+    key = _video_cache_key(url, format_code)
+    with _download_locks_guard:
+        lock = _download_locks.setdefault(key, threading.Lock())
+    with lock:
+        try:
+            cached = _get_cache_path(url, format_code)
+            if cached:
+                logger.info("🔄 Using cached file: %s", cached)
+                return cached
+            return _fetch_video(url, format_code, player_client=player_client, warmup=warmup)
+        finally:
+            with _download_locks_guard:
+                if _download_locks.get(key) is lock:
+                    del _download_locks[key]
+
+def _fetch_video(url: str, format_code: str, *, player_client: Optional[str], warmup: bool) -> str:
+    # Reuse a fresh extraction from /formats or get_best_available_format if we have one. That
+    # extraction used the default clients, so a forced client always extracts anew.
+    info = _get_cached_info(url) if player_client is None else None
+    if info is None and warmup:
+        # Create a realistic browser session first
+        _create_realistic_session(url)
 
     # Map simple resolution tokens to robust selectors
-    selector_map = {
-        "best": "bestvideo[ext=mp4]+bestaudio/best",
-        "1080": "bestvideo[height<=1080][ext=mp4]+bestaudio/best/best[height<=1080][ext=mp4]/best",
-        "720":  "bestvideo[height<=720][ext=mp4]+bestaudio/best/best[height<=720][ext=mp4]/best",
-        "480":  "bestvideo[height<=480][ext=mp4]+bestaudio/best/best[height<=480][ext=mp4]/best",
-        "360":  "bestvideo[height<=360][ext=mp4]+bestaudio/best/best[height<=360][ext=mp4]/best",
-    }
-    selector = selector_map.get(format_code, format_code)
+    selector = _SELECTOR_MAP.get(format_code, format_code)
 
-    # Add small random delay to look more human
-    time.sleep(random.uniform(0.5, 1.5))
+    if _humanize_delays():
+        # Add small random delay to look more human
+        time.sleep(_rng().uniform(0.5, 1.5))
 
-    ydl_opts = _build_common_opts()
+    ydl_opts = _build_common_opts(player_client)
     ydl_opts.update({
         "format": selector,
         "ignoreerrors": False,
     })
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = _extract_info_guard(ydl, url, download=True)
-        out = ydl.prepare_filename(info)
-        if not out.lower().endswith(".mp4"):
-            base, _ = os.path.splitext(out)
-            mp4 = base + ".mp4"
-            if os.path.exists(mp4):
-                out = mp4
-        if not os.path.exists(out) or os.path.getsize(out) <= 0:
-            raise yt_dlp.utils.DownloadError("File missing or empty after download")
-        _set_cache(url, format_code, out)
-        return out
-
-def download_with_retry(url: str, format_code: str, max_retries: int = 3) -> str:
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            if info is not None:
+                # process_ie_result mutates the dict, so hand it a copy of the cached one
+                info = ydl.process_ie_result(copy.deepcopy(info), download=True)
+            else:
+                info = _extract_info_guard(ydl, url, download=True)
+            out = ydl.prepare_filename(info)
+    except yt_dlp.utils.YoutubeDLError:
+        # Stale format URLs are a likely cause, so force a fresh extraction next time. Format
+        # selection on saved info fails with a bare ExtractorError, so catch the common base.
+        _drop_cached_info(url)
+        raise
+    size = 0
+    if not out.lower().endswith(".mp4"):
+        # Merged output lands as .mp4 even when the info dict names the source container
+        mp4 = os.path.splitext(out)[0] + ".mp4"
+        size = _file_size(mp4)
+        if size:
+            out = mp4
+    if not size:
+        size = _file_size(out)
+    if size <= 0:
+        _drop_cached_info(url)
+        raise yt_dlp.utils.DownloadError("File missing or empty after download")
+    _set_cache(url, format_code, out)
+    return out
+
+def _root_cause(e: BaseException) -> BaseException:
+    """Follow yt-dlp's wrapped exc_info / cause chain down to the original error"""
+    for _ in range(5):
+        inner = getattr(e, "exc_info", None)
+        inner = inner[1] if isinstance(inner, tuple) and len(inner) > 1 else None
+        inner = inner or getattr(e, "cause", None) or e.__cause__
+        if not isinstance(inner, BaseException) or inner is e:
+            break
+        # An ExtractorError is the meaningful error; what it wraps (KeyError, TypeError from a
+        # changed response shape) is an implementation detail. Only HTTP errors carry a status.
+        if isinstance(e, yt_dlp.utils.ExtractorError) and not isinstance(inner, yt_dlp.networking.exceptions.HTTPError):
+            break
+        e = inner
+    return e
+
+def _is_permanent_error(e: Exception) -> bool:
+    """True for failures that another attempt (format, client) won't fix"""
+    msg = str(e)
+    if any(marker in msg for marker in PERMANENT_ERROR_MARKERS):
+        return True
+    cause = _root_cause(e)
+    if isinstance(cause, yt_dlp.utils.UnsupportedError):
+        return True
+    # 4xx other than 403/408/429 won't change on retry; 403 is usually an expired signature
+    status = getattr(cause, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (403, 408, 429)
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """Seconds from a 429's Retry-After header, when the server sent one"""
+    cause = _root_cause(e)
+    if getattr(cause, "status", None) != 429:
+        return None
+    headers = getattr(getattr(cause, "response", None), "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+def _retry_strategies(format_code: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """(format_code, player_client) for each attempt: as asked, another selector, then the mobile client"""
+    # For "best", fall back to a progressive single-file stream rather than repeating the merge
+    alternate_format = "best[ext=mp4]/best" if format_code == "best" else "best"
+    return ((format_code, None), (alternate_format, None), (format_code, "ios"))
+
+def download_with_retry(url: str, format_code: str, max_retries: int = 3, total_budget_s: Optional[float] = None) -> str:
     last = None
+    url = normalize_youtube_url(url)
+    max_retries = max(1, min(max_retries, RETRIES))
+    strategies = _retry_strategies(format_code)
+    sleep = RETRY_BACKOFF_BASE
+    deadline = time.monotonic() + (RETRY_DEADLINE if total_budget_s is None else total_budget_s)
+    attempt_est = 0.0  # EWMA of attempt durations
     for i in range(max_retries):
+        # Past the listed strategies, keep retrying the original request
+        fmt, client = strategies[i] if i < len(strategies) else strategies[0]
+        if i > 0:
+            logger.info("🔄 Retry %d/%d - format %s%s", i, max_retries, fmt, f", {client} client" if client else "")
+        started = time.monotonic()
         try:
-            if i > 0:
-                # Add variable delays that look more human
-                sleep_time = 2 ** i + random.uniform(0.5, 2.5)
-                print(f"🔄 Retry {i}/{max_retries} - waiting {sleep_time:.2f}s")
-                time.sleep(sleep_time)
-                
-                # Vary the approach on retries
-                if i == 1:
-                    # On first retry, try a different format selector
-                    if format_code == "best":
-                        alternate_format = "bestvideo[ext=mp4]+bestaudio/best"
-                    else:
-                        alternate_format = "best"
-                    print(f"🔄 Trying alternate format: {alternate_format}")
-                    return download_video(url, alternate_format)
-                elif i == 2:
-                    # On second retry, try with mobile client
-                    print("🔄 Trying with mobile client")
-                    os.environ["YTDLP_OVERRIDE_CLIENT"] = "ios"
-                    try:
-                        result = download_video(url, format_code)
-                        return result
-                    finally:
-                        os.environ.pop("YTDLP_OVERRIDE_CLIENT", None)
-            
-            return download_video(url, format_code)
+            # Only the first attempt warms up; the session is still fresh for the retries
+            return _download_video_core(url, fmt, player_client=client, warmup=i == 0)
         except Exception as e:
             last = e
+            took = time.monotonic() - started
+            attempt_est = took if i == 0 else 0.5 * attempt_est + 0.5 * took
+            if _is_permanent_error(e):
+                logger.error("❌ Attempt %d failed permanently, not retrying: %s", i + 1, e)
+                break
             if i < max_retries - 1:
-                # Human-like variable retry delay (don't sleep after the last attempt)
-                sleep = 2 ** (i + 1) + random.uniform(0.1, 1.0)
-                print(f"⚠️ Attempt {i+1} failed: {e}. Sleeping {sleep:.2f}s")
+                # Decorrelated jitter: spread out and bounded, without sleeping after the last attempt
+                sleep = min(RETRY_BACKOFF_CAP, _rng().uniform(RETRY_BACKOFF_BASE, sleep * 3))
+                # Leave the next attempt room to finish inside the budget
+                remaining = deadline - time.monotonic() - attempt_est
+                # A rate-limited response says how long to wait; retrying sooner just gets limited
+                # again, so wait the full time or give up when it's longer than we allow
+                hint = _retry_after(e)
+                if hint is not None:
+                    if hint > RETRY_BACKOFF_CAP or hint > remaining:
+                        logger.error("❌ Attempt %d was rate limited for %.0fs, not retrying: %s", i + 1, hint, e)
+                        break
+                    sleep = hint
+                elif remaining <= 0:
+                    logger.error("❌ Attempt %d failed and the retry budget is spent: %s", i + 1, e)
+                    break
+                else:
+                    # Shorten the backoff if that's enough to fit the next attempt in
+                    sleep = min(sleep, remaining)
+                logger.warning("⚠️ Attempt %d failed: %s. Sleeping %.2fs", i + 1, e, sleep)
                 time.sleep(sleep)
     raise last or RuntimeError("Unknown error")
+
+def download_many(urls: List[str], format_code: str = "best", max_workers: int = 4) -> List[Future]:
+    """Download several URLs in parallel threads, returning one Future per URL in input order"""
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download")
+    try:
+        return [pool.submit(download_with_retry, url, format_code) for url in urls]
+    finally:
+        # Don't block here; queued downloads still run and the workers exit when done
+        pool.shutdown(wait=False)